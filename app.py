@@ -1,43 +1,175 @@
+import codecs
+import hashlib
+import itertools
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import streamlit as st
-import openai
-from pypdf import PdfReader
-import docx
-import pandas as pd
-from pptx import Presentation
-
-# Configuration de la page
-st.set_page_config(
-    page_title="AI Document Summarizer",
-    page_icon="📄",
-    layout="wide"
-)
-
-# Configuration d'OpenAI avec la clé API depuis les secrets
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+from openai import OpenAI, RateLimitError, Timeout
+import tiktoken
+
+# Configuration de la page. Les processus d'extraction PDF (spawn)
+# ré-exécutent ce fichier en tant que __mp_main__ : ils ne font que définir
+# les fonctions, sans page ni appel à main().
+if __name__ != "__mp_main__":
+    st.set_page_config(
+        page_title="AI Document Summarizer",
+        page_icon="📄",
+        layout="wide"
+    )
+
+# Modèle et prompt système communs à tous les appels
+SUMMARY_MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "You are an expert document summarizer."
+
+# Client OpenAI partagé entre les reruns : le pool de connexions HTTP
+# (keep-alive, reprise de session TLS) est conservé d'un appel à l'autre.
+# Les erreurs transitoires (429, 5xx, coupures réseau) sont réessayées par
+# le SDK avec un backoff exponentiel.
+@st.cache_resource
+def get_openai_client():
+    return OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        max_retries=3,
+        timeout=Timeout(30.0, connect=5.0)
+    )
+
+LANGUAGES = ["français", "anglais", "espagnol", "allemand"]
+
+SUMMARY_TYPES = {
+    "vulgarized": "Vulgarisé",
+    "technical": "Technique",
+    "bullets": "Points clés",
+    "executive": "Executive Summary"
+}
+
+# Modèles de prompt selon le type de résumé
+PROMPT_TEMPLATES = {
+    "vulgarized": "Résume ce texte de manière simple et accessible en {language} (~{max_length} mots) :\n\n{text}",
+    "technical": "Fais un résumé technique de ce texte en {language}, en te concentrant sur les aspects techniques (~{max_length} mots) :\n\n{text}",
+    "bullets": "Liste les points clés de ce texte en {language} (maximum {max_length} points) :\n\n{text}",
+    "executive": "Crée un executive summary de ce texte en {language} (~{max_length} mots) :\n\n{text}"
+}
+
+CHUNK_PROMPT_TEMPLATE = "Résume fidèlement cet extrait de document en {language}, en conservant toutes les informations importantes :\n\n{text}"
+
+# Au-delà de cette taille, le document est résumé par morceaux (map-reduce)
+MAX_SINGLE_PASS_TOKENS = 12000
+CHUNK_TOKENS = 3000
+# Longueur maximale du résumé de chaque morceau (phase map)
+CHUNK_SUMMARY_TOKENS = 500
+
+# Taille maximale traitée : borne le nombre d'appels de la phase map et la
+# taille de la synthèse finale ; le reste du document est ignoré
+MAX_INPUT_TOKENS = 200000
+
+MAX_OUTPUT_TOKENS = 4096
+
+# Nombre de résumés conservés par session (les plus anciens sont oubliés)
+MAX_CACHED_SUMMARIES = 20
 
+# En dessous de ce nombre de pages, l'extraction parallèle ne vaut pas le
+# coût de relecture du PDF dans chaque processus
+PARALLEL_PDF_MIN_PAGES = 20
+
+# Chaque tâche transporte une copie du PDF : nombre de processus borné, et
+# calculé sur les CPU réellement alloués (conteneur) plutôt que ceux de l'hôte
+if hasattr(os, "sched_getaffinity"):
+    PDF_WORKERS = min(len(os.sched_getaffinity(0)), 4)
+else:
+    PDF_WORKERS = min(os.cpu_count() or 1, 4)
+
+# "spawn" plutôt que fork : le serveur Streamlit est multithreadé. Chaque
+# processus ré-importe app.py (streamlit, openai, tiktoken) une seule fois à
+# son démarrage ; le pool est conservé entre les reruns pour amortir ce coût.
+@st.cache_resource
+def _get_pdf_pool():
+    return ProcessPoolExecutor(
+        max_workers=PDF_WORKERS,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def _pdf_pages(reader):
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+# Les bibliothèques de lecture sont importées dans chaque extracteur : elles
+# ne sont chargées que lorsqu'un fichier du type correspondant est lu.
 def extract_text_from_pdf(file):
+    from pypdf import PdfReader
+
     try:
         reader = PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        n_pages = len(reader.pages)
+        if n_pages <= PARALLEL_PDF_MIN_PAGES:
+            return "\n".join(_pdf_pages(reader))
+
+        # Gros PDF : une plage de pages contiguës par processus
+        from pdf_pages import extract_pages
+
+        data = file.getvalue()
+        step = -(-n_pages // PDF_WORKERS)
+        tasks = [(data, start, min(start + step, n_pages)) for start in range(0, n_pages, step)]
+        try:
+            results = list(_get_pdf_pool().map(extract_pages, tasks))
+        except BrokenProcessPool:
+            # Processus mort (mémoire...) : pool recréé au prochain appel,
+            # extraction séquentielle pour celui-ci
+            _get_pdf_pool.clear()
+            return "\n".join(_pdf_pages(reader))
+        return "\n".join(text for texts in results for text in texts)
     except Exception as e:
         st.error(f"Erreur lors de la lecture du PDF: {str(e)}")
         return None
 
 def extract_text_from_docx(file):
+    import docx
+
     try:
         doc = docx.Document(file)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        return "\n".join(paragraph.text for paragraph in doc.paragraphs)
     except Exception as e:
         st.error(f"Erreur lors de la lecture du DOCX: {str(e)}")
         return None
 
 def extract_text_from_excel(file):
+    import openpyxl
+
+    try:
+        # Lecture en streaming : seuls l'en-tête et l'aperçu sont chargés
+        wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            if (ws.max_row or 0) <= 1:
+                # Dimensions absentes ou réduites à "A1" par certains outils :
+                # lecture sans bornes de lignes ni de colonnes
+                ws.reset_dimensions()
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, ())
+            preview = list(itertools.islice(rows, 5))
+            n_rows = ws.max_row - 1 if ws.max_row else 0
+            if n_rows < len(preview):
+                # Dimensions non fiables : comptage explicite
+                n_rows = len(preview) + sum(1 for _ in rows)
+        finally:
+            wb.close()
+
+        text = "Colonnes : " + ", ".join("" if c is None else str(c) for c in header) + "\n\n"
+        text += f"Nombre de lignes : {n_rows}\n"
+        text += "Aperçu des données :\n"
+        text += "\n".join(" | ".join("" if v is None else str(v) for v in row) for row in preview)
+        return text
+    except Exception as e:
+        st.error(f"Erreur lors de la lecture du fichier Excel: {str(e)}")
+        return None
+
+def extract_text_from_xls(file):
+    # Ancien format .xls, non supporté par openpyxl
+    import pandas as pd
+
     try:
         df = pd.read_excel(file)
         text = "Colonnes : " + ", ".join(df.columns) + "\n\n"
@@ -49,99 +181,179 @@ def extract_text_from_excel(file):
         st.error(f"Erreur lors de la lecture du fichier Excel: {str(e)}")
         return None
 
+def _pptx_lines(prs):
+    for i, slide in enumerate(prs.slides, 1):
+        yield f"\nDiapositive {i}:"
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                yield shape.text
+
 def extract_text_from_pptx(file):
+    from pptx import Presentation
+
     try:
-        prs = Presentation(file)
-        text = ""
-        for i, slide in enumerate(prs.slides, 1):
-            text += f"\nDiapositive {i}:\n"
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + "\n"
-        return text
+        return "\n".join(_pptx_lines(Presentation(file)))
     except Exception as e:
         st.error(f"Erreur lors de la lecture du PowerPoint: {str(e)}")
         return None
 
+class _ReadError(Exception):
+    """Échec de lecture déjà signalé à l'utilisateur par l'extracteur."""
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _read_file(file_name, file_type, digest, _uploaded_file):
+    # Mis en cache sur (nom, type, empreinte du contenu) : un même fichier
+    # n'est pas ré-analysé à chaque rerun de Streamlit. Les échecs lèvent une
+    # exception et ne sont donc jamais mis en cache.
+    if file_type == "application/pdf":
+        text = extract_text_from_pdf(_uploaded_file)
+    elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        text = extract_text_from_docx(_uploaded_file)
+    elif file_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
+        text = extract_text_from_excel(_uploaded_file)
+    elif file_type == "application/vnd.ms-excel":
+        text = extract_text_from_xls(_uploaded_file)
+    elif file_type in ["application/vnd.ms-powerpoint", "application/vnd.openxmlformats-officedocument.presentationml.presentation"]:
+        text = extract_text_from_pptx(_uploaded_file)
+    else:
+        text = _uploaded_file.getvalue().decode("utf-8")
+
+    if text is None:
+        raise _ReadError()
+    return text
+
 def get_file_content(uploaded_file):
     if uploaded_file is None:
         return None
-    
+
+    digest = hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
     try:
-        file_type = uploaded_file.type
-        if file_type == "application/pdf":
-            return extract_text_from_pdf(uploaded_file)
-        elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            return extract_text_from_docx(uploaded_file)
-        elif file_type in ["application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]:
-            return extract_text_from_excel(uploaded_file)
-        elif file_type in ["application/vnd.ms-powerpoint", "application/vnd.openxmlformats-officedocument.presentationml.presentation"]:
-            return extract_text_from_pptx(uploaded_file)
-        else:
-            return uploaded_file.getvalue().decode("utf-8")
+        return _read_file(uploaded_file.name, uploaded_file.type, digest, uploaded_file)
+    except _ReadError:
+        return None
     except Exception as e:
         st.error(f"Erreur lors de la lecture du fichier : {str(e)}")
         return None
 
+@st.cache_resource
+def get_encoding():
+    return tiktoken.encoding_for_model(SUMMARY_MODEL)
+
+def _chunk_text(text, max_tokens=CHUNK_TOKENS, max_total=MAX_INPUT_TOKENS):
+    """Découpe le texte en morceaux d'au plus max_tokens, sur des fins de phrases.
+
+    Le texte n'est tokenisé qu'une fois, phrase par phrase, et tronqué à
+    max_total tokens. Renvoie (morceaux, nombre de tokens, tronqué ou non).
+    """
+    enc = get_encoding()
+    chunks = []
+    current = ""
+    current_tokens = 0
+    total = 0
+    truncated = False
+    for sentence in re.split(r"(?<=[.!?\n])", text):
+        # encode_ordinary : les chaînes comme "<|endoftext|>" sont du texte
+        tokens = enc.encode_ordinary(sentence)
+        if total + len(tokens) > max_total:
+            # Limite atteinte : début de la phrase conservé, un caractère
+            # UTF-8 coupé en fin de troncature est abandonné
+            tokens = tokens[:max_total - total]
+            sentence = enc.decode_bytes(tokens).decode("utf-8", errors="ignore")
+            truncated = True
+        total += len(tokens)
+
+        # Phrase trop longue à elle seule (tableau, texte sans ponctuation...)
+        if len(tokens) > max_tokens:
+            if current:
+                chunks.append(current)
+                current, current_tokens = "", 0
+            # Décodage incrémental : un caractère UTF-8 coupé entre deux
+            # tranches de tokens est reporté sur la tranche suivante
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            for i in range(0, len(tokens), max_tokens):
+                piece = decoder.decode(enc.decode_bytes(tokens[i:i + max_tokens]))
+                if piece:
+                    chunks.append(piece)
+        else:
+            if current_tokens + len(tokens) > max_tokens:
+                chunks.append(current)
+                current, current_tokens = "", 0
+            current += sentence
+            current_tokens += len(tokens)
+
+        if truncated:
+            break
+    if current.strip():
+        chunks.append(current)
+    return chunks, total, truncated
+
+def _summarize_chunk(client, chunk, target_language):
+    response = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": CHUNK_PROMPT_TEMPLATE.format(language=target_language, text=chunk)}
+        ],
+        temperature=0.7,
+        max_tokens=CHUNK_SUMMARY_TOKENS
+    )
+    # content vaut None si la réponse est filtrée : morceau ignoré
+    return response.choices[0].message.content or ""
+
+def _max_output_tokens(summary_type, max_length):
+    # ~1,6 token par mot en français/anglais, ~15 tokens par point clé
+    if summary_type == "bullets":
+        return min(max_length * 15 + 64, MAX_OUTPUT_TOKENS)
+    return min(int(max_length * 1.6) + 64, MAX_OUTPUT_TOKENS)
+
 def get_summary(text, summary_type, target_language, max_length):
+    """Génère le résumé en streaming, morceau par morceau."""
     if not text:
-        return None
-    
-    try:
-        # Préparation du prompt selon le type de résumé
-        prompts = {
-            "vulgarized": f"Résume ce texte de manière simple et accessible en {target_language} (~{max_length} mots) :\n\n{text}",
-            "technical": f"Fais un résumé technique de ce texte en {target_language}, en te concentrant sur les aspects techniques (~{max_length} mots) :\n\n{text}",
-            "bullets": f"Liste les points clés de ce texte en {target_language} (maximum {max_length} points) :\n\n{text}",
-            "executive": f"Crée un executive summary de ce texte en {target_language} (~{max_length} mots) :\n\n{text}"
-        }
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Tu es un expert en résumé et synthèse de documents."},
-                {"role": "user", "content": prompts[summary_type]}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        return response['choices'][0]['message']['content']
-    except Exception as e:
-        st.error(f"Erreur lors de la génération du résumé : {str(e)}")
-        return None
+        return
 
-def main():
-    st.title("📄 AI Document Summarizer")
+    client = get_openai_client()
 
-    # Configuration dans la barre latérale
-    with st.sidebar:
-        st.header("Paramètres")
-        
-        target_language = st.selectbox(
-            "Langue du résumé",
-            ["français", "anglais", "espagnol", "allemand"],
-            index=0
-        )
-        
-        summary_type = st.selectbox(
-            "Type de résumé",
-            ["vulgarized", "technical", "bullets", "executive"],
-            format_func=lambda x: {
-                "vulgarized": "Vulgarisé",
-                "technical": "Technique",
-                "bullets": "Points clés",
-                "executive": "Executive Summary"
-            }[x]
-        )
-        
-        max_length = st.slider(
-            "Longueur approximative",
-            min_value=100,
-            max_value=1000,
-            value=300,
-            step=50
-        )
+    # Un token fait au moins un octet : en dessous de ce seuil, le document
+    # tient en un seul appel et n'a pas besoin d'être tokenisé
+    if len(text.encode()) > MAX_SINGLE_PASS_TOKENS:
+        # Comptage local des tokens, avant tout envoi à l'API
+        chunks, n_tokens, truncated = _chunk_text(text)
+        if truncated:
+            st.warning(f"Document trop long : seuls les {MAX_INPUT_TOKENS} premiers tokens seront résumés.")
+
+        # Document long : résumé de chaque morceau en parallèle, puis synthèse finale
+        if n_tokens > MAX_SINGLE_PASS_TOKENS:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                partials = list(executor.map(lambda chunk: _summarize_chunk(client, chunk, target_language), chunks))
+            text = "\n\n".join(partials)
+
+    prompt = PROMPT_TEMPLATES[summary_type].format(
+        language=target_language, max_length=max_length, text=text
+    )
+
+    response = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        max_tokens=_max_output_tokens(summary_type, max_length),
+        stream=True
+    )
+
+    for chunk in response:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+# Panneau principal isolé dans un fragment : un clic sur ses widgets
+# (source, fichier, bouton) ne ré-exécute que ce panneau, pas la page entière.
+# Les paramètres de la barre latérale sont lus dans st.session_state.
+@st.fragment
+def summary_panel():
+    target_language = st.session_state.target_language
+    summary_type = st.session_state.summary_type
+    max_length = st.session_state.max_length
 
     # Zone principale
     source_type = st.radio(
@@ -175,21 +387,83 @@ def main():
                 st.text_area("", text, height=400)
 
         if st.button("Générer le résumé", type="primary"):
-            with st.spinner("Génération du résumé..."):
-                summary = get_summary(text, summary_type, target_language, max_length)
-                
+            with col2:
+                st.subheader("Résumé")
+                placeholder = st.empty()
+
+                # Résumés déjà générés dans cette session, par document et paramètres
+                if "summaries" not in st.session_state:
+                    st.session_state.summaries = {}
+                doc_hash = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+                cache_key = (doc_hash, summary_type, target_language, max_length)
+
+                summary = st.session_state.summaries.get(cache_key, "")
+                if summary:
+                    placeholder.markdown(summary)
+                else:
+                    try:
+                        with st.spinner("Génération du résumé..."):
+                            # Affichage progressif au fil des tokens reçus
+                            summary = placeholder.write_stream(
+                                get_summary(text, summary_type, target_language, max_length)
+                            )
+                        if summary:
+                            summaries = st.session_state.summaries
+                            summaries[cache_key] = summary
+                            if len(summaries) > MAX_CACHED_SUMMARIES:
+                                # Ordre d'insertion du dict : la plus ancienne entrée en premier
+                                del summaries[next(iter(summaries))]
+                    except RateLimitError:
+                        placeholder.empty()
+                        st.error("Limite de requêtes OpenAI atteinte, veuillez réessayer dans quelques instants.")
+                        summary = ""
+                    except Exception as e:
+                        # Autres erreurs de l'API (après les réessais du SDK)
+                        # ou échec local (tokenisation, découpage...)
+                        placeholder.empty()
+                        st.error(f"Erreur lors de la génération du résumé : {str(e)}")
+                        summary = ""
+
                 if summary:
-                    with col2:
-                        st.subheader("Résumé")
-                        st.markdown(summary)
-                        
-                        st.download_button(
-                            "📥 Télécharger le résumé",
-                            summary,
-                            "resume.txt",
-                            "text/plain",
-                            use_container_width=True
-                        )
+                    st.download_button(
+                        "📥 Télécharger le résumé",
+                        summary,
+                        "resume.txt",
+                        "text/plain",
+                        use_container_width=True
+                    )
+
+def main():
+    st.title("📄 AI Document Summarizer")
+
+    # Configuration dans la barre latérale
+    with st.sidebar:
+        st.header("Paramètres")
+        
+        st.selectbox(
+            "Langue du résumé",
+            LANGUAGES,
+            index=0,
+            key="target_language"
+        )
+        
+        st.selectbox(
+            "Type de résumé",
+            list(SUMMARY_TYPES),
+            format_func=SUMMARY_TYPES.__getitem__,
+            key="summary_type"
+        )
+        
+        st.slider(
+            "Longueur approximative",
+            min_value=100,
+            max_value=1000,
+            value=300,
+            step=50,
+            key="max_length"
+        )
+
+    summary_panel()
 
 if __name__ == "__main__":
     main()
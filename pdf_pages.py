@@ -0,0 +1,16 @@
+"""Extraction de pages PDF exécutée dans les processus du pool.
+
+Module séparé de app.py : la fonction est sérialisée par son nom de
+module et ne dépend pas du module __main__ de substitution de Streamlit.
+Les processus lancés en spawn ré-exécutent tout de même app.py en tant
+que __mp_main__ (voir _get_pdf_pool).
+"""
+import io
+
+from pypdf import PdfReader
+
+
+def extract_pages(args):
+    data, start, stop = args
+    reader = PdfReader(io.BytesIO(data))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]